@@ -1,4 +1,7 @@
 import streamlit as st
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time
 import guide_logic
 import scraper_llm
@@ -49,9 +52,104 @@ st.markdown("""
 """)
 st.divider()
 
+# ---------------------------------------------------------
+# 일정표 선행 분석 (Speculative Prefetch)
+# ---------------------------------------------------------
+# URL 입력 즉시 백그라운드에서 캡처+분석을 시작하여, 나머지 항목을 입력하는 동안 결과를 준비합니다.
+PLAUSIBLE_URL_PATTERN = re.compile(r'^https?://[^\s/]+\.[^\s/]+\S*$')
+MAX_PREFETCH_RESULTS = 5
+
+@st.cache_resource
+def get_prefetch_executor():
+    # Shared across sessions; each prefetch holds a Chrome instance at most, so keep it small
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+def cancel_prefetches(keep_url=None):
+    """
+    Cancels every prefetch except the one for keep_url.
+    """
+    prefetches = st.session_state.setdefault("prefetches", {})
+    for other_url in list(prefetches):
+        if other_url != keep_url:
+            future, cancel_event = prefetches.pop(other_url)
+            cancel_event.set()
+            future.cancel()
+
+def store_prefetch_result(url, result):
+    results = st.session_state.setdefault("prefetch_results", {})
+    results.pop(url, None)
+    results[url] = result
+    while len(results) > MAX_PREFETCH_RESULTS:
+        del results[next(iter(results))]
+
+def collect_prefetches():
+    """
+    Moves finished prefetches into prefetch_results (keyed by URL), so reruns reuse them.
+    Failed results are dropped so the URL can be prefetched again.
+    """
+    prefetches = st.session_state.setdefault("prefetches", {})
+    for url in [u for u, (future, _) in prefetches.items() if future.done()]:
+        future, _ = prefetches.pop(url)
+        if future.cancelled():
+            continue
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"[Prefetch] Failed for {url}: {e}")
+            continue
+        if "error" in result:
+            print(f"[Prefetch] Failed for {url}: {result['error']}")
+            continue
+        store_prefetch_result(url, result)
+
+def start_prefetch(url):
+    """
+    Starts background analysis for the URL (keyed by URL in session state)
+    and cancels any superseded prefetch. URLs that already have a result are not analyzed again.
+    """
+    cancel_prefetches(keep_url=url)
+    collect_prefetches()
+    prefetches = st.session_state["prefetches"]
+    if url in prefetches or url in st.session_state.get("prefetch_results", {}):
+        return
+
+    cancel_event = threading.Event()
+    future = get_prefetch_executor().submit(scraper_llm.analyze_content, url=url, cancel_event=cancel_event)
+    prefetches[url] = (future, cancel_event)
+
+def take_prefetch_result(url):
+    """
+    Returns the prefetched result for the URL, or None if unavailable/failed.
+    Waits only for a prefetch that is already running; one still queued behind
+    other jobs is cancelled so the caller can analyze right away.
+    """
+    collect_prefetches()
+    entry = st.session_state["prefetches"].get(url)
+    if entry is not None:
+        future, _ = entry
+        if future.cancel():
+            st.session_state["prefetches"].pop(url)
+            return None
+        try:
+            future.result()
+        except Exception:
+            pass  # Recorded by collect_prefetches below
+        collect_prefetches()
+
+    # Only successful results are stored; otherwise the caller analyzes synchronously
+    return st.session_state.get("prefetch_results", {}).get(url)
+
 # ---------------------------------------------------------
 # 사용자 입력 폼
 # ---------------------------------------------------------
+# URL은 폼 밖에 두어 입력 즉시 선행 분석을 시작합니다.
+tour_url = st.text_input("여행 일정표 URL", placeholder="https://...", help="URL을 입력하면 나머지 항목을 작성하는 동안 일정표 분석이 미리 시작됩니다.").strip()
+# 업로드된 파일이 있으면 URL 분석 결과는 사용되지 않으므로 선행 분석하지 않습니다.
+if PLAUSIBLE_URL_PATTERN.match(tour_url) and not st.session_state.get("itinerary_upload"):
+    start_prefetch(tour_url)
+else:
+    cancel_prefetches()
+
 with st.form("guide_input_form"):
     st.markdown('<div class="section-header">1. 기본 정보 입력</div>', unsafe_allow_html=True)
     
@@ -61,11 +159,10 @@ with st.form("guide_input_form"):
         manager_name = st.text_input("담당자 이름/직함", placeholder="예: 김이름 팀장")
         # flight_date input removed as per user request
     with col2:
-        tour_url = st.text_input("여행 일정표 URL", placeholder="https://...")
         room_count = st.number_input("객실 수 (Room Count)", min_value=1, value=1, help="호텔 매너팁 계산에 사용됩니다.")
 
     st.markdown('<div class="section-header">2. 여행 일정표(스크린샷) 업로드 (권장 📸)</div>', unsafe_allow_html=True)
-    uploaded_file = st.file_uploader("URL만으로 내용이 안 나올 경우, 일정표 화면을 캡쳐해서 올려주세요. (PDF 지원)", type=['png', 'jpg', 'jpeg', 'pdf'])
+    uploaded_file = st.file_uploader("URL만으로 내용이 안 나올 경우, 일정표 화면을 캡쳐해서 올려주세요. (PDF 지원)", type=['png', 'jpg', 'jpeg', 'pdf'], key="itinerary_upload")
 
     st.markdown('<div class="section-header">3. 차량 서비스 설정 (Incheon Airport Service)</div>', unsafe_allow_html=True)
     
@@ -95,14 +192,26 @@ with st.form("guide_input_form"):
 if submit_button:
     # 0. 데이터 추출 (URL or Image)
     with st.spinner("AI가 여행 정보를 분석 중입니다... (약 10~20초 소요)"):
-        top_image_bytes = uploaded_file.getvalue() if uploaded_file else None
+        # getbuffer() exposes the upload as a memoryview without copying it
+        top_image_bytes = uploaded_file.getbuffer() if uploaded_file else None
+        
+        # Uploaded file takes precedence; otherwise reuse the prefetched URL analysis if ready
+        if uploaded_file:
+            cancel_prefetches()
+            scraped_data = None
+        else:
+            scraped_data = take_prefetch_result(tour_url)
         
         # Call Scraper logic
-        scraped_data = scraper_llm.analyze_content(
-            url=tour_url,
-            image_bytes=top_image_bytes,
-            mime_type=uploaded_file.type if uploaded_file else "image/jpeg"
-        )
+        if scraped_data is None:
+            scraped_data = scraper_llm.analyze_content(
+                url=tour_url,
+                image_bytes=top_image_bytes,
+                mime_type=uploaded_file.type if uploaded_file else "image/jpeg"
+            )
+            if not uploaded_file and tour_url and "error" not in scraped_data:
+                # Keep it so reruns (e.g. the download button) don't analyze the URL again
+                store_prefetch_result(tour_url, scraped_data)
         
         if "error" in scraped_data:
             st.warning(f"데이터 분석 중 경고가 발생했습니다: {scraped_data['error']}")
@@ -205,3 +314,17 @@ if submit_button:
     
 else:
     st.info("👈 왼쪽 정보를 입력하고 '생성하기' 버튼을 눌러주세요.")
+
+# ---------------------------------------------------------
+# 추출 모델 지표 (Model Cascade Metrics)
+# ---------------------------------------------------------
+# 모델 단계별 지연 시간/비용/상위 모델 전환율 (서버 프로세스 기준 누적, 할당량 튜닝용)
+with st.sidebar.expander("📊 추출 모델 지표 (Cascade Metrics)"):
+    cascade_metrics = scraper_llm.get_cascade_metrics()
+    st.caption(f"분석 문서 수: {cascade_metrics['documents']}")
+    for model_name, stats in cascade_metrics["tiers"].items():
+        st.markdown(f"**{model_name}**")
+        st.write(
+            f"호출 {stats['calls']}회 · 평균 {stats['avg_latency_s']:.1f}초 · "
+            f"${stats['cost_usd']:.4f} · 상위 모델 전환율 {stats['escalation_rate']:.0%}"
+        )
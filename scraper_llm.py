@@ -2,6 +2,12 @@ import os
 import json
 import time
 import sys
+import hashlib
+import mmap
+import re
+import datetime
+import threading
+import tempfile
 # Force UTF-8 encoding for stdout to verify logs in Windows terminals
 sys.stdout.reconfigure(encoding='utf-8')
 from google import genai
@@ -13,6 +19,10 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from bs4 import BeautifulSoup
 
 # Load environment variables
 load_dotenv()
@@ -27,10 +37,261 @@ if not API_KEY:
 import base64
 from selenium.webdriver.common.print_page_options import PrintOptions
 
-def capture_pdf_from_url(url: str) -> Optional[bytes]:
+B64_CHUNK_CHARS = 4 * 256 * 1024  # Multiple of 4 so each chunk decodes independently
+
+# ---------------------------------------------------------
+# Tier 1: Lightweight HTTP + DOM capture
+# ---------------------------------------------------------
+HTTP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+HTTP_TIMEOUT = 15  # seconds
+MIN_TEXT_LENGTH = 1500  # Below this the page is most likely a JS shell
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+DOMAIN_TIER_TTL = 6 * 60 * 60  # seconds; remembered tiers are re-checked after this
+
+# Challenge-page markers that are specific enough to match against the raw HTML.
+# (Cloudflare also injects /cdn-cgi/challenge-platform/scripts/jsd/ into normal pages, so only the /h/ challenge path counts.)
+CHALLENGE_HTML_MARKERS = (
+    "cf-chl",
+    "cf_chl_opt",
+    "/cdn-cgi/challenge-platform/h/",
+    "Request unsuccessful. Incapsula incident",
+    "_Incapsula_Resource",
+)
+
+# Markers matched against the page <title> only (never scripts, where they appear in ordinary strings)
+BOT_PROTECTION_TITLE_MARKERS = (
+    "Just a moment...",
+    "Attention Required!",
+    "Access Denied",
+    "Security Check",
+)
+
+# Markers that indicate the itinerary is rendered client-side
+JS_REQUIRED_MARKERS = (
+    "enable JavaScript",
+    "JavaScript를 활성화",
+    "id=\"__next\"></div>",
+    "id=\"root\"></div>",
+    "id=\"app\"></div>",
+)
+
+# Itinerary signals. Server-rendered shells (terms, navigation) can be long without any of these
+# when the schedule itself is loaded by XHR or inside an <iframe>, so at least two must be present.
+ITINERARY_SIGNAL_PATTERNS = (
+    re.compile(r'\b[A-Z][A-Z0-9]\s?\d{2,4}\b'),          # Flight number (KE901, OZ 501)
+    re.compile(r'\b20\d{2}[./-]\d{1,2}[./-]\d{1,2}\b'),   # Date (2026.05.14)
+    re.compile(r'불포함|포함\s*(내역|사항)'),                # 포함/불포함 section
+    re.compile(r'\d+\s*일차|제\s*\d+\s*일|DAY\s*\d+', re.IGNORECASE),  # Day-by-day schedule
+)
+MIN_ITINERARY_SIGNALS = 2
+
+# Per-domain memory of which tier worked last: {"www.example.com": ("http" | "browser", recorded_at)}
+_domain_tiers = {}
+
+# Pooled HTTP session (keep-alive connections are reused across captures)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def _get_http_session() -> requests.Session:
+    global _http_session
+    with _http_session_lock:  # Prefetch workers may ask for it concurrently
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "User-Agent": HTTP_USER_AGENT,
+                "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7",
+            })
+            _http_session = session
+        return _http_session
+
+def _get_domain_tier(domain: str) -> Optional[str]:
+    entry = _domain_tiers.get(domain)
+    if entry is None:
+        return None
+    tier, recorded_at = entry
+    if time.time() - recorded_at > DOMAIN_TIER_TTL:
+        _domain_tiers.pop(domain, None)  # Expired: check the cheaper tier again (another thread may have popped it)
+        return None
+    return tier
+
+def _set_domain_tier(domain: str, tier: str):
+    _domain_tiers[domain] = (tier, time.time())
+
+def _needs_browser(html: str, title: str, text: str) -> bool:
+    """
+    Returns True if the fetched page looks like a bot-protection page, a JS shell,
+    or a page whose itinerary is not in the server-rendered HTML.
+    """
+    if any(marker in html for marker in CHALLENGE_HTML_MARKERS) or \
+            any(marker.lower() in title.lower() for marker in BOT_PROTECTION_TITLE_MARKERS):
+        print("[HTTP] Bot-protection content detected.")
+        return True
+    if len(text) < MIN_TEXT_LENGTH:
+        lowered = html.lower()
+        if any(marker.lower() in lowered for marker in JS_REQUIRED_MARKERS):
+            print("[HTTP] Page requires JavaScript rendering.")
+        else:
+            print(f"[HTTP] Too little text extracted ({len(text)} chars).")
+        return True
+    signals = sum(1 for pattern in ITINERARY_SIGNAL_PATTERNS if pattern.search(text))
+    if signals < MIN_ITINERARY_SIGNALS:
+        print(f"[HTTP] No itinerary found in the HTML ({signals} signal(s)); schedule is likely loaded dynamically.")
+        return True
+    return False
+
+def _extract_page_text(html: str):
+    """
+    Extracts the page title and readable text/tables (tables as pipe-separated rows) from the HTML.
+    Returns (title, text).
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Agency name usually lives in the site name meta tag or the header logo
+    site_meta = soup.find("meta", property="og:site_name")
+    site_name = site_meta.get("content", "").strip() if site_meta else ""
+    if not site_name:
+        logo = soup.find("img", alt=True, src=re.compile("logo", re.IGNORECASE)) or \
+            soup.find("img", alt=True, class_=re.compile("logo", re.IGNORECASE))
+        site_name = logo["alt"].strip() if logo else ""
+
+    # header/footer are kept: they carry the agency name and branch/contact info
+    for tag in soup(["script", "style", "noscript", "svg", "iframe", "nav"]):
+        tag.decompose()
+
+    # Tables carry the flight schedule / 포함·불포함 lists, keep their grid structure
+    table_blocks = []
+    for table in soup.find_all("table"):
+        rows = []
+        for tr in table.find_all("tr"):
+            cells = [cell.get_text(" ", strip=True) for cell in tr.find_all(["th", "td"])]
+            if any(cells):
+                rows.append(" | ".join(cells))
+        if rows:
+            table_blocks.append("\n".join(rows))
+        table.decompose()
+
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    body = soup.body if soup.body else soup
+    lines = [line.strip() for line in body.get_text("\n").splitlines()]
+    text = "\n".join(line for line in lines if line)
+
+    sections = []
+    if title or site_name:
+        sections.append(f"[Title]\n{title}" + (f"\n(Site: {site_name})" if site_name else ""))
+    if text:
+        sections.append(f"[Text]\n{text}")
+    for i, block in enumerate(table_blocks, 1):
+        sections.append(f"[Table {i}]\n{block}")
+    return title, "\n\n".join(sections)
+
+def capture_from_http(url: str):
+    """
+    Fetches the URL with a plain pooled HTTP request.
+    Returns ("http", text) for an HTML page whose itinerary is server-rendered,
+    ("document", (mmap, mime_type)) when the URL points directly to a PDF/image,
+    ("browser", None) if the page needs a real browser (blocked status, JavaScript / bot-protection /
+    dynamic schedule, unsupported content type), or (None, None) on a transient failure (timeout, reset).
+    """
+    print(f"[HTTP] Fetching URL: {url}")
+    try:
+        with _get_http_session().get(url, timeout=HTTP_TIMEOUT, stream=True) as response:
+            if response.status_code in (403, 429, 503):
+                print(f"[HTTP] Blocked with status {response.status_code}.")
+                return "browser", None
+            response.raise_for_status()
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type == "application/pdf" or content_type.startswith("image/"):
+                document = _chunks_to_mmap(response.iter_content(SPOOL_CHUNK_BYTES))
+                if document is None:
+                    return None, None
+                print(f"[Success] Downloaded {content_type} document via HTTP.")
+                return "document", (document, content_type)
+            if content_type not in HTML_CONTENT_TYPES:
+                print(f"[HTTP] Unsupported content type: {content_type or 'unknown'}")
+                return "browser", None
+
+            if not response.encoding or response.encoding.lower() == "iso-8859-1":
+                response.encoding = response.apparent_encoding
+            html = response.text
+
+        title, text = _extract_page_text(html)
+        if _needs_browser(html, title, text):
+            return "browser", None
+
+        print(f"[Success] Extracted {len(text)} chars via HTTP.")
+        return "http", text
+    except Exception as e:
+        print(f"[Error] HTTP fetch failed: {e}")
+        return None, None
+
+def capture_from_url(url: str):
+    """
+    Tiered capture: tries the lightweight HTTP fetch first and falls back to Selenium PDF.
+    Remembers per domain (for DOMAIN_TIER_TTL) which tier worked so later captures skip the failing tier.
+    Returns (tier, payload) where tier is "http" (payload: str), "document" (payload: (mmap, mime_type))
+    or "browser" (payload: PDF mmap), or (None, None) if every tier failed.
+    """
+    domain = urlparse(url).netloc.lower()
+
+    needs_browser = False
+    if _get_domain_tier(domain) != "browser":
+        tier, payload = capture_from_http(url)
+        if tier == "http":
+            _set_domain_tier(domain, "http")
+        if tier in ("http", "document"):
+            # A direct PDF/image link says nothing about how the domain's pages render
+            return tier, payload
+        needs_browser = tier == "browser"
+    else:
+        print(f"[Tier] {domain} is known to need a browser. Skipping HTTP fetch.")
+
+    pdf = capture_pdf_from_url(url)
+    if pdf:
+        # Only remember "browser" when HTTP failed for a real reason, not a transient network error
+        if needs_browser:
+            _set_domain_tier(domain, "browser")
+        return "browser", pdf
+
+    return None, None
+
+# ---------------------------------------------------------
+# Tier 2: Headless browser (Selenium) PDF capture
+# ---------------------------------------------------------
+def _chunks_to_mmap(chunks) -> Optional[mmap.mmap]:
+    """
+    Writes byte chunks into a temp file and maps it read-only, so large documents stay off the heap.
+    """
+    spool = tempfile.TemporaryFile()
+    try:
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.flush()
+        if spool.tell() == 0:
+            return None
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        spool.close()  # The mapping keeps the data alive
+
+def _b64decode_to_mmap(data_b64: str) -> Optional[mmap.mmap]:
+    """
+    Decodes a base64 string chunk by chunk into a temp file and maps it read-only,
+    so the decoded PDF never sits on the heap next to the base64 string.
+    """
+    return _chunks_to_mmap(
+        base64.b64decode(data_b64[start:start + B64_CHUNK_CHARS])
+        for start in range(0, len(data_b64), B64_CHUNK_CHARS)
+    )
+
+def capture_pdf_from_url(url: str) -> Optional[mmap.mmap]:
     """
     Captures the webpage as a PDF using Selenium (Chrome DevTools).
     This is superior to screenshots because it preserves text data even if fonts are missing.
+    Returns a read-only memory map of the PDF (bytes-like) backed by a temp file.
     """
     print(f"[Selenium] Accessing URL to generate PDF: {url}")
     
@@ -73,9 +334,11 @@ def capture_pdf_from_url(url: str) -> Optional[bytes]:
         print_options.background = True # Include background graphics
         
         pdf_b64 = driver.print_page(print_options)
+        pdf_map = _b64decode_to_mmap(pdf_b64)
+        del pdf_b64
         
         print("[Success] PDF generated successfully.")
-        return base64.b64decode(pdf_b64)
+        return pdf_map
         
     except Exception as e:
         print(f"[Error] Error generating PDF: {e}")
@@ -84,44 +347,457 @@ def capture_pdf_from_url(url: str) -> Optional[bytes]:
         if driver:
             driver.quit()
 
-def analyze_content(url=None, image_bytes=None, mime_type="image/jpeg"):
+# ---------------------------------------------------------
+# Document upload (File API, upload once)
+# ---------------------------------------------------------
+INLINE_LIMIT_BYTES = 4 * 1024 * 1024  # Larger documents are uploaded once via the File API
+SPOOL_CHUNK_BYTES = 1024 * 1024
+FILE_PROCESSING_TIMEOUT = 120  # seconds
+MAX_CACHED_UPLOADS = 32
+
+# Rate limiting (429 Resource Exhausted) backoff, shared by uploads and generate_content
+RATE_LIMIT_MAX_RETRIES = 5
+RATE_LIMIT_BASE_DELAY = 10  # seconds
+
+# Uploaded file handles keyed by SHA-256 of the document: {digest: types.File} (oldest first)
+_uploaded_files = {}
+_uploads_lock = threading.Lock()
+
+def _is_rate_limited(error) -> bool:
+    error_str = str(error)
+    return "429" in error_str or "Resource has been exhausted" in error_str
+
+def _rate_limit_backoff(attempt, cancel_event=None):
+    wait_time = RATE_LIMIT_BASE_DELAY * (2 ** attempt)  # 10, 20, 40...
+    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] [Wait] Rate limit hit. Waiting {wait_time} seconds before retrying...")
+    if cancel_event is not None:
+        cancel_event.wait(wait_time)  # Wakes up early if cancelled
+    else:
+        time.sleep(wait_time)
+
+def _spool_to_tempfile(view: memoryview):
+    """
+    Writes a bytes-like view into a temp file in chunks (slicing a memoryview does not copy).
+    """
+    spool = tempfile.TemporaryFile()
+    for start in range(0, view.nbytes, SPOOL_CHUNK_BYTES):
+        spool.write(view[start:start + SPOOL_CHUNK_BYTES])
+    spool.seek(0)
+    return spool
+
+def _is_file_usable(file) -> bool:
+    state = getattr(file.state, "name", file.state)
+    if state == "FAILED":
+        return False
+    expiration = file.expiration_time
+    if expiration and expiration.timestamp() - time.time() < 600:  # Leave 10 min of headroom
+        return False
+    return True
+
+def _get_cached_upload(digest: str):
+    """
+    Returns the cached handle for the digest, evicting expired/failed handles along the way.
+    """
+    with _uploads_lock:
+        for key in [k for k, f in _uploaded_files.items() if not _is_file_usable(f)]:
+            del _uploaded_files[key]
+        return _uploaded_files.get(digest)
+
+def _cache_upload(digest: str, uploaded):
+    with _uploads_lock:
+        _uploaded_files.pop(digest, None)
+        _uploaded_files[digest] = uploaded
+        while len(_uploaded_files) > MAX_CACHED_UPLOADS:
+            del _uploaded_files[next(iter(_uploaded_files))]
+
+def _upload_document(client, view: memoryview, mime_type: str, digest: str, cancel_event=None):
+    """
+    Uploads the document once through the File API and waits until it is ready.
+    The handle is cached by content digest so retries and repeated runs reuse it.
+    """
+    cached = _get_cached_upload(digest)
+    if cached:
+        print(f"[Upload] Reusing uploaded file {cached.name}.")
+        return cached
+
+    print(f"[Upload] Uploading {view.nbytes / (1024 * 1024):.1f} MB document ({mime_type})...")
+    with _spool_to_tempfile(view) as spool:
+        for attempt in range(RATE_LIMIT_MAX_RETRIES):
+            # Checked before each attempt, so a cancelled prefetch stops instead of retrying right away
+            if cancel_event is not None and cancel_event.is_set():
+                print("[Cancel] Upload cancelled.")
+                raise AnalysisCancelled(CANCELLED_ERROR)
+            try:
+                spool.seek(0)
+                uploaded = client.files.upload(file=spool, config=types.UploadFileConfig(mime_type=mime_type))
+                break
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == RATE_LIMIT_MAX_RETRIES - 1:
+                    raise
+                print(f"[Warning] Upload rate limited (Attempt {attempt + 1}/{RATE_LIMIT_MAX_RETRIES}): {e}")
+                _rate_limit_backoff(attempt, cancel_event)
+
+    deadline = time.time() + FILE_PROCESSING_TIMEOUT
+    while getattr(uploaded.state, "name", uploaded.state) == "PROCESSING":
+        if time.time() > deadline:
+            raise TimeoutError(f"File processing timed out: {uploaded.name}")
+        time.sleep(2)
+        uploaded = client.files.get(name=uploaded.name)
+
+    if getattr(uploaded.state, "name", uploaded.state) == "FAILED":
+        raise RuntimeError(f"File processing failed: {uploaded.name}")
+
+    _cache_upload(digest, uploaded)
+    return uploaded
+
+def _build_document_part(client, data, mime_type: str, cancel_event=None):
+    """
+    Builds the content part for an image/PDF once, before the retry loop.
+    Small documents are inlined; large ones are referenced by their uploaded file handle,
+    so retries only re-send the URI instead of the whole payload.
+    """
+    # Release the views explicitly so an mmap source can be closed right after
+    with memoryview(data) as raw, raw.cast("B") as view:
+        if view.nbytes <= INLINE_LIMIT_BYTES:
+            return types.Part.from_bytes(data=view.tobytes(), mime_type=mime_type)
+
+        digest = hashlib.sha256(view).hexdigest()
+        uploaded = _upload_document(client, view, mime_type, digest, cancel_event)
+    return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+
+CANCELLED_ERROR = "분석이 취소되었습니다."
+
+class AnalysisCancelled(Exception):
+    """Raised when a background (prefetch) analysis is cancelled mid-stage."""
+
+# ---------------------------------------------------------
+# Model cascade (cheap model first, escalate low-confidence fields)
+# ---------------------------------------------------------
+# Ordered cheapest -> strongest. Override with e.g. GEMINI_MODEL_CASCADE="gemini-flash-lite-latest,gemini-flash-latest,gemini-pro-latest"
+DEFAULT_MODEL_CASCADE = ["gemini-flash-lite-latest", "gemini-flash-latest"]
+# An empty/comma-only value falls back to the default rather than running no model at all
+MODEL_CASCADE = [m.strip() for m in os.getenv("GEMINI_MODEL_CASCADE", "").split(",") if m.strip()] or DEFAULT_MODEL_CASCADE
+CONFIDENCE_THRESHOLD = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Estimated USD per 1M tokens (input, output) for cost metrics. Unknown models count as 0.
+MODEL_PRICES = {
+    "gemini-flash-lite-latest": (0.10, 0.40),
+    "gemini-flash-latest": (0.30, 2.50),
+    "gemini-pro-latest": (1.25, 10.00),
+}
+
+# Fields read from the document itself (weather/currency/etc. are predicted and not scored)
+SCORED_FIELDS = ("tour_title", "agency_name", "flight_dep", "flight_arr", "meeting_info", "hotel_info", "tips_info", "shopping_info")
+# A weak critical field escalates even when the overall score passes the threshold
+CRITICAL_FIELDS = ("flight_dep", "flight_arr", "tips_info")
+
+FLIGHT_NUM_PATTERN = re.compile(r'^[A-Z0-9]{2}\d{1,4}[A-Z]?$')
+DATE_PATTERN = re.compile(r'^(\d{4})\.(\d{2})\.(\d{2})$')
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+TIP_AMOUNT_PATTERN = re.compile(r'\d')
+
+FIELD_ESCALATION_PROMPT = """
+    A previous extraction of this document was incomplete or inconsistent for some fields.
+    Re-read the ENTIRE document carefully and return ONLY a JSON object containing these keys: {fields}
+    Follow the same structure and directives as above for each key.
+    """
+
+def _parse_date(value) -> Optional[datetime.datetime]:
+    match = DATE_PATTERN.match(str(value or "").strip())
+    if not match:
+        return None
+    try:
+        return datetime.datetime(*map(int, match.groups()))
+    except ValueError:
+        return None
+
+def _is_flight_plausible(flight) -> bool:
+    if not isinstance(flight, dict):
+        return False
+    flight_num = str(flight.get("flight_num", "")).replace(" ", "").upper()
+    if not FLIGHT_NUM_PATTERN.match(flight_num):
+        return False
+
+    dep_date = _parse_date(flight.get("date"))
+    if not dep_date or not TIME_PATTERN.match(str(flight.get("time", "")).strip()):
+        return False
+    this_year = datetime.datetime.now().year
+    if not (this_year - 1 <= dep_date.year <= this_year + 2):
+        return False
+
+    # Arrival (if given) must be within -1..+2 days of departure (eastbound flights over the date line arrive "earlier")
+    arr_date = _parse_date(flight.get("arrival_date"))
+    if flight.get("arrival_date") and not arr_date:
+        return False
+    if arr_date and not (-1 <= (arr_date - dep_date).days <= 2):
+        return False
+    return True
+
+def _is_tips_consistent(tips) -> bool:
+    """
+    Checks the 포함/불포함 tipping answer against the prompt rules:
+    included -> '상품가 포함 (현지 지불 없음)', excluded -> '1인 [금액] [통화] (현지 지불)'.
+    """
+    tips = str(tips or "").strip()
+    if not tips:
+        return False
+    says_included = "상품가 포함" in tips or "지불 없음" in tips
+    says_excluded = "불포함" in tips or ("현지 지불" in tips and "지불 없음" not in tips)
+    if says_included and says_excluded:
+        return False
+    if says_included:
+        return not TIP_AMOUNT_PATTERN.search(tips)
+    # Excluded tips must state an amount
+    return bool(TIP_AMOUNT_PATTERN.search(tips))
+
+def _is_field_plausible(field, value) -> bool:
+    if field in ("flight_dep", "flight_arr"):
+        return _is_flight_plausible(value)
+    if field == "tips_info":
+        return _is_tips_consistent(value)
+    return bool(str(value or "").strip())
+
+def score_extraction(data):
+    """
+    Scores an extraction for completeness and plausibility.
+    Returns (score between 0 and 1, list of weak field names).
+    """
+    if not isinstance(data, dict) or "error" in data:
+        return 0.0, list(SCORED_FIELDS)
+
+    weak = []
+    for field in SCORED_FIELDS:
+        if not _is_field_plausible(field, data.get(field)):
+            weak.append(field)
+
+    # Outbound flight must not depart after the return flight
+    flight_dep, flight_arr = data.get("flight_dep"), data.get("flight_arr")
+    dep_date = _parse_date(flight_dep.get("date")) if isinstance(flight_dep, dict) else None
+    ret_date = _parse_date(flight_arr.get("date")) if isinstance(flight_arr, dict) else None
+    if dep_date and ret_date and ret_date < dep_date:
+        for field in ("flight_dep", "flight_arr"):
+            if field not in weak:
+                weak.append(field)
+
+    return 1 - len(weak) / len(SCORED_FIELDS), weak
+
+# Per-tier metrics: {model: {"calls", "latency_s", "input_tokens", "output_tokens", "cost_usd", "escalations"}}
+_cascade_metrics = {}
+_cascade_documents = 0
+_metrics_lock = threading.Lock()
+
+def _record_tier_call(model_name, latency, usage, escalated):
+    input_tokens = (getattr(usage, "prompt_token_count", None) or 0) if usage else 0
+    output_tokens = 0
+    if usage:
+        # Thinking tokens are billed at the output rate
+        output_tokens = (getattr(usage, "candidates_token_count", None) or 0) + (getattr(usage, "thoughts_token_count", None) or 0)
+    price_in, price_out = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    cost = (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+    with _metrics_lock:
+        stats = _cascade_metrics.setdefault(model_name, {
+            "calls": 0, "latency_s": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "escalations": 0,
+        })
+        stats["calls"] += 1
+        stats["latency_s"] += latency
+        stats["input_tokens"] += input_tokens
+        stats["output_tokens"] += output_tokens
+        stats["cost_usd"] += cost
+        stats["escalations"] += int(escalated)
+
+    print(f"[Cascade] {model_name}: {latency:.1f}s, {input_tokens}+{output_tokens} tokens, ${cost:.5f}{' -> escalated' if escalated else ''}")
+
+def get_cascade_metrics():
+    """
+    Returns a snapshot of per-tier metrics (avg latency, cost, escalation rate) for tuning.
+    """
+    with _metrics_lock:
+        summary = {"documents": _cascade_documents, "tiers": {}}
+        for model_name, stats in _cascade_metrics.items():
+            calls = stats["calls"] or 1
+            summary["tiers"][model_name] = {
+                **stats,
+                "avg_latency_s": stats["latency_s"] / calls,
+                "escalation_rate": stats["escalations"] / calls,
+            }
+        return summary
+
+def _log_cascade_summary():
+    summary = get_cascade_metrics()
+    for model_name, stats in summary["tiers"].items():
+        print(f"[Cascade] Totals {model_name}: {stats['calls']} calls, avg {stats['avg_latency_s']:.1f}s, "
+              f"${stats['cost_usd']:.4f}, escalation rate {stats['escalation_rate']:.0%} ({summary['documents']} documents)")
+
+def _generate_json(client, model_name, contents, cancel_event=None):
+    """
+    Calls Gemini with retry on rate limiting and parses the JSON answer.
+    Returns (result dict, usage metadata or None).
+    """
+    # Retry logic for Rate Limiting (429 Resource Exhausted)
+    max_retries = RATE_LIMIT_MAX_RETRIES
+
+    for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            print("[Cancel] Analysis cancelled.")
+            return {"error": CANCELLED_ERROR}, None
+        try:
+            print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] Sending request to Gemini ({model_name})...")
+            response = client.models.generate_content(
+                model=model_name,
+                contents=contents
+            )
+            
+            # Parse JSON
+            result_text = response.text.strip()
+            # Clean possible markdown block
+            if result_text.startswith("```"):
+                lines = result_text.splitlines()
+                if lines[0].startswith("```"):
+                    lines = lines[1:]
+                if lines and lines[-1].startswith("```"):
+                    lines = lines[:-1]
+                result_text = "\n".join(lines).strip()
+                
+            return json.loads(result_text), response.usage_metadata
+            
+        except Exception as e:
+            current_time = datetime.datetime.now().strftime('%H:%M:%S')
+            print(f"[{current_time}] [Warning] Gemini API Error (Attempt {attempt + 1}/{max_retries}): {e}")
+            
+            # Check for Rate Limit (429)
+            if _is_rate_limited(e):
+                if attempt < max_retries - 1:
+                    _rate_limit_backoff(attempt, cancel_event)
+                    continue
+                else:
+                     return {"error": f"API 할당량 초과로 인해 {max_retries}회 재시도 후에도 실패했습니다. 잠시 후(몇 분 뒤) 다시 시도해주세요. (Error: {e})"}, None
+            else:
+                # Non-retriable error
+                return {"error": f"Non-retriable error: {str(e)}"}, None
+
+def _run_cascade(client, prompt, content_parts, cancel_event=None):
+    """
+    Runs the extraction on the cheapest model first and escalates only when the result
+    scores below CONFIDENCE_THRESHOLD or a critical field is weak. Escalated tiers are
+    asked for the weak fields only, and their answers are merged into the result.
+    """
+    global _cascade_documents
+    with _metrics_lock:
+        _cascade_documents += 1
+
+    result = None
+    weak = list(SCORED_FIELDS)
+    for tier, model_name in enumerate(MODEL_CASCADE):
+        is_last = tier == len(MODEL_CASCADE) - 1
+        if result is None:
+            contents = [prompt] + content_parts
+        else:
+            contents = [prompt, FIELD_ESCALATION_PROMPT.format(fields=", ".join(weak))] + content_parts
+
+        started = time.time()
+        answer, usage = _generate_json(client, model_name, contents, cancel_event)
+        latency = time.time() - started
+        if not isinstance(answer, dict):
+            answer = {"error": f"Unexpected response format from {model_name}: expected a JSON object, got {type(answer).__name__}"}
+
+        if "error" in answer:
+            _record_tier_call(model_name, latency, usage, escalated=not is_last)
+            if answer["error"] == CANCELLED_ERROR or is_last:
+                return result if result is not None else answer
+            continue
+
+        if result is None:
+            result = answer
+        else:
+            # Take the stronger tier's value only if it passes the same checks (or the cheaper one is empty)
+            result.update({
+                k: v for k, v in answer.items()
+                if k in weak and v and (not result.get(k) or _is_field_plausible(k, v))
+            })
+
+        score, weak = score_extraction(result)
+        escalate = not is_last and (score < CONFIDENCE_THRESHOLD or any(f in weak for f in CRITICAL_FIELDS))
+        _record_tier_call(model_name, latency, usage, escalated=escalate)
+        print(f"[Cascade] Confidence {score:.2f} (weak: {', '.join(weak) or 'none'})")
+        if not escalate:
+            return result
+
+    return result
+
+
+def analyze_content(url=None, image_bytes=None, mime_type="image/jpeg", cancel_event=None):
     """
     Analyzes content.
-    1. If user uploads an image/PDF, use it.
-    2. If user provides a URL, AUTO-GENERATE a PDF using Selenium, then use that.
+    1. If user uploads an image/PDF, use it. (image_bytes may be any bytes-like object, e.g. a memoryview)
+    2. If user provides a URL, fetch it via plain HTTP, or AUTO-GENERATE a PDF using Selenium
+       when the page needs JavaScript / is bot-protected.
+    cancel_event (threading.Event, optional): set it to abandon a background (prefetch) run.
+    The check happens between stages, so an in-flight capture or API call still completes.
     """
     client = genai.Client(api_key=API_KEY)
     
     content_parts = []
     
     # Validation
-    if not url and not image_bytes:
+    if not url and image_bytes is None:
         return {"error": "URL이나 이미지를 입력해주세요."}
 
     # 1. User Uploaded File
-    if image_bytes:
+    if image_bytes is not None:
         print(f"Processing User Uploaded File ({mime_type})...")
-        content_parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
+        try:
+            content_parts.append(_build_document_part(client, image_bytes, mime_type, cancel_event))
+        except AnalysisCancelled:
+            return {"error": CANCELLED_ERROR}
+        except Exception as e:
+            return {"error": f"파일 업로드에 실패했습니다: {e}"}
         content_parts.append("This is a travel itinerary document provided by the user.")
 
-    # 2. URL Logic (Auto-PDF)
+    # 2. URL Logic (HTTP text -> Auto-PDF fallback)
     elif url:
-        print(f"Processing URL with Auto-PDF: {url}")
+        print(f"Processing URL with tiered capture: {url}")
         
-        # 🚀 Generate PDF automatically
-        auto_pdf = capture_pdf_from_url(url)
+        # 🚀 Capture page (HTTP first, Selenium PDF if needed)
+        tier, captured = capture_from_url(url)
         
-        if auto_pdf:
+        if tier == "http":
+            content_parts.append(f"This is the text content of the web page at {url}. Tables are given as pipe-separated rows.")
+            content_parts.append(captured)
+        elif tier == "document":
+            # The URL links directly to an itinerary PDF/image
+            document, document_mime = captured
+            try:
+                content_parts.append(_build_document_part(client, document, document_mime, cancel_event))
+            except AnalysisCancelled:
+                return {"error": CANCELLED_ERROR}
+            except Exception as e:
+                return {"error": f"파일 업로드에 실패했습니다: {e}"}
+            finally:
+                document.close()
+            content_parts.append(f"This is a travel itinerary document downloaded from {url}.")
+        elif tier == "browser":
             # Use application/pdf for Gemini
-            content_parts.append(types.Part.from_bytes(data=auto_pdf, mime_type="application/pdf"))
+            try:
+                content_parts.append(_build_document_part(client, captured, "application/pdf", cancel_event))
+            except AnalysisCancelled:
+                return {"error": CANCELLED_ERROR}
+            except Exception as e:
+                return {"error": f"PDF 업로드에 실패했습니다: {e}"}
+            finally:
+                captured.close()
             content_parts.append(f"This is a PDF version of the web page at {url}. Analyze the text and layout.")
         else:
             return {"error": "자동 PDF 생성에 실패했습니다. (보안 설정이 강화된 사이트일 수 있습니다. 직접 파일을 업로드해주세요.)"}
 
+    if cancel_event is not None and cancel_event.is_set():
+        print("[Cancel] Analysis cancelled before sending to Gemini.")
+        return {"error": CANCELLED_ERROR}
+
     # Prompt Engineering (Updated for Visual Analysis)
     prompt = """
     You are a professional travel agent assistant.
-    Analyze the provided travel itinerary image (screenshot) or PDF document and extract the following information into a strict JSON format.
+    Analyze the provided travel itinerary image (screenshot), PDF document, or web page text and extract the following information into a strict JSON format.
     
     Target JSON Structure:
     {
@@ -171,53 +847,10 @@ def analyze_content(url=None, image_bytes=None, mime_type="image/jpeg"):
     - Return ONLY valid JSON.
     """
 
-    # Retry logic for Rate Limiting (429 Resource Exhausted)
-    max_retries = 5
-    base_delay = 10  # seconds
-
-    # Explicitly set model to a stable version
-    model_name = 'gemini-flash-latest' 
-
-    import datetime
-
-    for attempt in range(max_retries):
-        try:
-            print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] Sending request to Gemini ({model_name})...")
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[prompt] + content_parts
-            )
-            
-            # Parse JSON
-            result_text = response.text.strip()
-            # Clean possible markdown block
-            if result_text.startswith("```"):
-                lines = result_text.splitlines()
-                if lines[0].startswith("```"):
-                    lines = lines[1:]
-                if lines and lines[-1].startswith("```"):
-                    lines = lines[:-1]
-                result_text = "\n".join(lines).strip()
-                
-            return json.loads(result_text)
-            
-        except Exception as e:
-            error_str = str(e)
-            current_time = datetime.datetime.now().strftime('%H:%M:%S')
-            print(f"[{current_time}] [Warning] Gemini API Error (Attempt {attempt + 1}/{max_retries}): {e}")
-            
-            # Check for Rate Limit (429)
-            if "429" in error_str or "Resource has been exhausted" in error_str:
-                if attempt < max_retries - 1:
-                    wait_time = base_delay * (2 ** attempt)  # 10, 20, 40...
-                    print(f"[{current_time}] [Wait] Rate limit hit. Waiting {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                     return {"error": f"API 할당량 초과로 인해 {max_retries}회 재시도 후에도 실패했습니다. 잠시 후(몇 분 뒤) 다시 시도해주세요. (Error: {e})"}
-            else:
-                # Non-retriable error
-                return {"error": f"Non-retriable error: {str(e)}"}
+    # Cheapest model first; only low-confidence fields escalate (see MODEL_CASCADE)
+    result = _run_cascade(client, prompt, content_parts, cancel_event)
+    _log_cascade_summary()
+    return result
 
 if __name__ == "__main__":
     # Test logic